@@ -0,0 +1,218 @@
+"""账单按年分区与归档
+
+Postgres：transaction / transactionarchive 均按 date 做 RANGE 分区，每年一个分区，
+归档某年时把该年分区从热表 DETACH 后 ATTACH 到归档表（只改元数据，不搬数据）。
+其他数据库：归档时把该年的行 INSERT 到归档表并从热表删除。
+
+归档任务（在 server 目录下执行，依次处理每个分片，建议每天跑一次）：
+    python archive.py                 # 归档 HOT_YEARS 之前的所有年份
+    python archive.py --year 2023     # 归档指定年份
+    python archive.py --migrate       # 把已有的非分区 transaction 表迁移为分区表（仅 Postgres）
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+from sqlalchemy import delete, insert, inspect, select, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlmodel import Session, SQLModel
+from config import CONFIG
+from models import CATALOG_TABLES, ArchivedYear, Transaction, TransactionArchive
+
+PARTITIONED_TABLES = (Transaction.__table__, TransactionArchive.__table__)
+
+def year_range(year: int):
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+def partitioning_enabled(engine) -> bool:
+    return CONFIG.PARTITION_TRANSACTIONS and engine.dialect.name == "postgresql"
+
+def table_for_year(session: Session, year: int):
+    """新写入某一年的账单应落到的表"""
+    return TransactionArchive if session.get(ArchivedYear, year) else Transaction
+
+def models_for_year(session: Session, year: int):
+    """查询某一年的账单需要扫描的表
+
+    已归档年份以归档表为主，但归档提交前正在进行的写入仍可能落在热表，两张表都查；
+    Postgres 下热表已没有该年的分区，只会扫描默认分区。
+    """
+    return (Transaction, TransactionArchive) if session.get(ArchivedYear, year) else (Transaction,)
+
+# ---------- Postgres 分区 ----------
+
+def _quote(engine, name: str) -> str:
+    return engine.dialect.identifier_preparer.quote(name)
+
+def _is_partitioned(conn, table_name: str) -> bool:
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = :name AND pg_table_is_visible(c.oid)"
+    ), {"name": table_name}).first() is not None
+
+def _parent_of(conn, partition: str) -> Optional[str]:
+    return conn.execute(text(
+        "SELECT parent.relname FROM pg_inherits i "
+        "JOIN pg_class child ON child.oid = i.inhrelid "
+        "JOIN pg_class parent ON parent.oid = i.inhparent "
+        "WHERE child.relname = :name AND pg_table_is_visible(child.oid)"
+    ), {"name": partition}).scalar()
+
+# 多个 worker 同时启动、或与每日归档任务同时运行时，分区的检查与创建需要串行执行
+PARTITION_LOCK_KEY = 0x7472616E  # 任意固定值，同一数据库内所有进程共用
+
+def _lock_partitions(conn):
+    # 事务级锁，随 engine.begin() 的事务提交或回滚自动释放
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": PARTITION_LOCK_KEY})
+
+def _create_partitioned_table(conn, table):
+    # 分区表的主键必须包含分区键
+    ddl = str(CreateTable(table).compile(conn.engine)).strip()
+    ddl = ddl.replace("PRIMARY KEY (id)", "PRIMARY KEY (id, date)")
+    conn.execute(text(f"{ddl} PARTITION BY RANGE (date)"))
+    conn.execute(text(
+        f"CREATE TABLE {_quote(conn.engine, table.name + '_default')} "
+        f"PARTITION OF {_quote(conn.engine, table.name)} DEFAULT"
+    ))
+    for index in table.indexes:
+        conn.execute(CreateIndex(index))
+
+def ensure_year_partition(conn, year: int):
+    """为热表创建某年的分区；默认分区中已有的该年数据会一并移入"""
+    engine = conn.engine
+    partition = f"{Transaction.__table__.name}_{year}"
+    if _parent_of(conn, partition):
+        return
+    parent = _quote(engine, Transaction.__table__.name)
+    default = _quote(engine, Transaction.__table__.name + "_default")
+    name = _quote(engine, partition)
+    start, end = year_range(year)
+    bounds = {"start": start, "end": end}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {parent} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {default} WHERE date >= :start AND date < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), bounds)
+    conn.execute(text(
+        f"ALTER TABLE {parent} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+def init_partitions(engine):
+    """init_db 调用：Postgres 下以分区表形式建表，并确保当年与下一年的分区存在"""
+    if not partitioning_enabled(engine):
+        return
+    with engine.begin() as conn:
+        _lock_partitions(conn)
+        existing = set(inspect(conn).get_table_names())
+        others = [
+            t for t in SQLModel.metadata.sorted_tables
+            if t not in PARTITIONED_TABLES and t not in CATALOG_TABLES
+        ]
+        SQLModel.metadata.create_all(conn, tables=others)
+        for table in PARTITIONED_TABLES:
+            if table.name not in existing:
+                _create_partitioned_table(conn, table)
+        if not _is_partitioned(conn, Transaction.__table__.name):
+            print("transaction 表尚未分区，可执行 `python archive.py --migrate` 迁移")
+            return
+        year = datetime.now().year
+        for y in (year, year + 1):
+            ensure_year_partition(conn, y)
+
+def migrate_to_partitioned(engine):
+    """把已有的普通 transaction 表改造为按年分区的表"""
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Declarative partitioning requires PostgreSQL")
+    table = Transaction.__table__
+    legacy = table.name + "_legacy"
+    with engine.begin() as conn:
+        _lock_partitions(conn)
+        if _is_partitioned(conn, table.name):
+            return
+        q = lambda name: _quote(engine, name)
+        conn.execute(text(f"ALTER TABLE {q(table.name)} RENAME TO {q(legacy)}"))
+        # 索引与主键名在 schema 内唯一，先让出给新表
+        inspector = inspect(conn)
+        for index in inspector.get_indexes(legacy):
+            conn.execute(text(f"DROP INDEX IF EXISTS {q(index['name'])}"))
+        pk_name = inspector.get_pk_constraint(legacy).get("name")
+        if pk_name:
+            conn.execute(text(f"ALTER TABLE {q(legacy)} RENAME CONSTRAINT {q(pk_name)} TO {q(legacy + '_pkey')}"))
+        _create_partitioned_table(conn, table)
+        years = conn.execute(text(
+            f"SELECT DISTINCT CAST(EXTRACT(YEAR FROM date) AS INTEGER) FROM {q(legacy)}"
+        )).scalars().all()
+        for year in sorted(set(years) | {datetime.now().year, datetime.now().year + 1}):
+            ensure_year_partition(conn, year)
+        columns = ", ".join(q(c.name) for c in table.columns)
+        conn.execute(text(f"INSERT INTO {q(table.name)} ({columns}) SELECT {columns} FROM {q(legacy)}"))
+        conn.execute(text(f"DROP TABLE {q(legacy)}"))
+
+# ---------- 归档 ----------
+
+def _move_rows(conn, year: int):
+    # 逐行搬迁：非 Postgres 的全部数据，或 Postgres 中落在默认分区里的迟到数据
+    hot, cold = Transaction.__table__, TransactionArchive.__table__
+    start, end = year_range(year)
+    in_year = (hot.c.date >= start) & (hot.c.date < end)
+    columns = [c.name for c in hot.columns]
+    if conn.dialect.name == "postgresql":
+        # 删除与插入在同一条语句中完成，READ COMMITTED 下两条语句之间提交的行不会被漏搬后删掉
+        moved = delete(hot).where(in_year).returning(*hot.c).cte("moved")
+        conn.execute(insert(cold).from_select(columns, select(*[moved.c[name] for name in columns])).add_cte(moved))
+        return
+    # SQLite 的写锁从第一条语句持有到提交，其他写入无法插在两条语句之间
+    conn.execute(insert(cold).from_select(columns, select(*[hot.c[name] for name in columns]).where(in_year)))
+    conn.execute(delete(hot).where(in_year))
+
+def _move_partition(conn, year: int):
+    engine = conn.engine
+    partition = f"{Transaction.__table__.name}_{year}"
+    if _parent_of(conn, partition) != Transaction.__table__.name:
+        return
+    start, end = year_range(year)
+    name = _quote(engine, partition)
+    conn.execute(text(f"ALTER TABLE {_quote(engine, Transaction.__table__.name)} DETACH PARTITION {name}"))
+    if CONFIG.ARCHIVE_TABLESPACE:
+        conn.execute(text(f"ALTER TABLE {name} SET TABLESPACE {_quote(engine, CONFIG.ARCHIVE_TABLESPACE)}"))
+    conn.execute(text(
+        f"ALTER TABLE {_quote(engine, TransactionArchive.__table__.name)} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+def archive_year(engine, year: int):
+    if year >= datetime.now().year:
+        raise ValueError(f"Year {year} is not closed yet")
+    with engine.begin() as conn:
+        if partitioning_enabled(engine) and _is_partitioned(conn, Transaction.__table__.name):
+            _lock_partitions(conn)
+            _move_partition(conn, year)
+        _move_rows(conn, year)
+        if not conn.execute(select(ArchivedYear).where(ArchivedYear.year == year)).first():
+            conn.execute(insert(ArchivedYear.__table__).values(year=year, archived_at=datetime.utcnow()))
+
+def archive_closed_years(engine, years: Optional[Iterable[int]] = None):
+    if years is None:
+        cutoff = datetime.now().year - CONFIG.HOT_YEARS + 1
+        with engine.connect() as conn:
+            oldest = conn.execute(select(Transaction.date).order_by(Transaction.date).limit(1)).scalar()
+        years = range(oldest.year, cutoff) if oldest else []
+    archived = []
+    for year in years:
+        archive_year(engine, year)
+        archived.append(year)
+    return archived
+
+if __name__ == "__main__":
+    import argparse
+    from database import init_db, shard_map
+
+    parser = argparse.ArgumentParser(description="Archive closed years of transactions")
+    parser.add_argument("--year", type=int, action="append", help="year to archive (repeatable)")
+    parser.add_argument("--migrate", action="store_true", help="convert transaction to a partitioned table")
+    args = parser.parse_args()
+
+    init_db()
+    for name, engine in shard_map.engines.items():
+        if args.migrate:
+            migrate_to_partitioned(engine)
+        print(f"[{name}] archived:", archive_closed_years(engine, args.year))
@@ -2,7 +2,7 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
 from config import CONFIG
 
@@ -41,7 +41,7 @@ def create_token(data: dict, expires_delta: Optional[timedelta] = None, secret:
     encoded_jwt = jwt.encode(to_encode, secret, algorithm=CONFIG.ALGORITHM)
     return encoded_jwt
 
-async def get_current_user_id(token: str = Depends(oauth2_scheme)):
+async def get_current_user_id(request: Request, token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -52,6 +52,8 @@ async def get_current_user_id(token: str = Depends(oauth2_scheme)):
         user_id: str = payload.get("sub")
         if user_id is None or payload.get("type") != "access":
             raise credentials_exception
+        # 供数据库会话等下游依赖识别当前用户
+        request.state.user_id = user_id
         return user_id
     except JWTError:
         raise credentials_exception
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""账单写入吞吐对比：逐请求提交 vs 合并提交（group commit）
+
+用法（在 server 目录下）：
+    python benchmarks/group_commit.py --requests 2000 --concurrency 64
+默认使用临时 SQLite 文件，可通过 DATABASE_URL 指向 Postgres 测试库。
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import event
+from sqlmodel import Session
+import database
+from models import User, Asset
+from schemas import TransactionCreate
+from writer import GroupCommitWriter, apply_balance_deltas, create_transaction_op
+
+def setup_users(count: int):
+    database.init_db()
+    users = []
+    with Session(database.engine) as session:
+        for i in range(count):
+            user = User(email=f"bench-{time.time_ns()}-{i}@example.com", password="x")
+            asset = Asset(name="bench", type="cash", userId=user.id)
+            session.add(user)
+            session.add(asset)
+            users.append((user.id, asset.id))
+        session.commit()
+    return users
+
+def make_payload(asset_id: str) -> TransactionCreate:
+    return TransactionCreate(
+        amount=1.0, type="expense", categoryId="food", categoryName="餐饮",
+        date=datetime.now(), assetId=asset_id,
+    )
+
+def per_request_commit(user_id: str, asset_id: str):
+    with Session(database.engine) as session:
+        deltas = defaultdict(float)
+        create_transaction_op(session, user_id, make_payload(asset_id), deltas)
+        apply_balance_deltas(session, deltas)
+        session.commit()
+
+async def run(label: str, users, total: int, concurrency: int, submit):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        user_id, asset_id = users[i % len(users)]
+        async with semaphore:
+            await submit(user_id, asset_id)
+
+    commits = [0]
+    def count_commit(conn):
+        commits[0] += 1
+
+    event.listen(database.engine, "commit", count_commit)
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    elapsed = time.perf_counter() - start
+    event.remove(database.engine, "commit", count_commit)
+    print(f"{label:<20} {total} writes in {elapsed:.2f}s  ->  {total / elapsed:,.0f} writes/s  ({commits[0]} commits)")
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-delay-ms", type=int, default=5)
+    args = parser.parse_args()
+
+    users = setup_users(args.users)
+    print(f"database: {database.engine.url}")
+
+    await run("per-request commit", users, args.requests, args.concurrency,
+              lambda user_id, asset_id: run_in_threadpool(per_request_commit, user_id, asset_id))
+
+    writer = GroupCommitWriter(args.max_batch, args.max_delay_ms)
+    await writer.start()
+    await run("group commit", users, args.requests, args.concurrency,
+              lambda user_id, asset_id: writer.submit(create_transaction_op, user_id, make_payload(asset_id)))
+    await writer.stop()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+import threading
+import time
+from typing import Dict, List, Tuple
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlmodel import Session, select
+from models import Category, Transaction, TransactionArchive
+
+# 分类维度表的进程内缓存，每个数据库（分片、副本）各一份，分类整数键只在本库内有效
+# 分类按 (slug, name) 唯一，同一 slug 下不同名称各占一行，行一旦创建不再修改，
+# 账单保留录入时的分类名称。分类数量很少，整表加载；本进程新增分类的事务提交后立即失效，
+# 其他进程新增的分类在超过 TTL 后整表可见，查找未命中时单独查库补上
+CACHE_TTL_SECONDS = 60
+
+class CategoryCache:
+    def __init__(self, engine):
+        self.engine = engine
+        self.by_id: Dict[int, Category] = {}
+        self.by_pair: Dict[Tuple[str, str], Category] = {}
+        self.by_slug: Dict[str, List[int]] = {}
+        self.loaded_at = 0.0
+        self.stale = True
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self.version += 1
+        self.stale = True
+
+    def _reload(self):
+        with self._lock, Session(self.engine) as session:
+            version = self.version
+            rows = session.exec(select(Category)).all()
+            for row in rows:
+                session.expunge(row)
+            by_slug = {}
+            for r in rows:
+                by_slug.setdefault(r.slug, []).append(r.id)
+            self.by_id = {r.id: r for r in rows}
+            self.by_pair = {(r.slug, r.name): r for r in rows}
+            self.by_slug = by_slug
+            self.loaded_at = time.monotonic()
+            # 加载期间又有分类提交时保持失效，下次访问再加载
+            self.stale = version != self.version
+
+    def _expired(self) -> bool:
+        return self.stale or time.monotonic() - self.loaded_at > CACHE_TTL_SECONDS
+
+    def get(self, category_id: int) -> Category:
+        # 整数键来自账单的外键，未命中只可能是其他进程新建的分类，重新加载一次即可命中
+        if self._expired() or category_id not in self.by_id:
+            self._reload()
+        return self.by_id[category_id]
+
+    def keys_for(self, slug: str) -> List[int]:
+        """按前端分类标识查所有整数键（同一 slug 可能有多个名称）
+
+        slug 来自请求参数，未命中时只按索引查这个 slug，不整表重新加载
+        """
+        if self._expired():
+            self._reload()
+        keys = self.by_slug.get(slug)
+        if keys is None:
+            with Session(self.engine) as session:
+                keys = list(session.exec(select(Category.id).where(Category.slug == slug)).all())
+            if keys:
+                # 其他进程新建的分类，下次访问时整表加载
+                self.invalidate()
+        return keys
+
+    def resolve(self, session: Session, slug: str, name: str) -> int:
+        """在调用方事务内按 (slug, name) 查找或创建分类，返回整数键"""
+        if not self._expired():
+            category = self.by_pair.get((slug, name))
+            if category:
+                return category.id
+        statement = select(Category).where(Category.slug == slug, Category.name == name)
+        existing = session.exec(statement).first()
+        if existing:
+            return existing.id
+        try:
+            with session.begin_nested():
+                category = Category(slug=slug, name=name)
+                session.add(category)
+        except IntegrityError:
+            # 并发请求已创建同一分类
+            return session.exec(statement).one().id
+        return category.id
+
+_caches: Dict[object, CategoryCache] = {}
+_caches_lock = threading.Lock()
+
+def category_cache_for(bind) -> CategoryCache:
+    """取某个会话 / 连接 / 引擎对应数据库的分类缓存"""
+    if isinstance(bind, Session):
+        bind = bind.get_bind()
+    engine = getattr(bind, "engine", bind)
+    cache = _caches.get(engine)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.setdefault(engine, CategoryCache(engine))
+    return cache
+
+@event.listens_for(Category, "after_insert")
+@event.listens_for(Category, "after_update")
+@event.listens_for(Category, "after_delete")
+def _mark_changed(mapper, connection, target):
+    # 此时事务尚未提交，其他连接看不到新行；记下对应的缓存，事务结束后再失效
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_categories", set()).add(category_cache_for(connection))
+
+@event.listens_for(Session, "after_transaction_end")
+def _invalidate_cache(session, transaction):
+    # 只在最外层事务结束（提交或回滚）后处理，SAVEPOINT 释放时新行对其他连接仍不可见
+    if transaction.parent is not None:
+        return
+    for cache in session.info.pop("changed_categories", ()):
+        cache.invalidate()
+
+def migrate_categories(engine):
+    """把旧表中的 categoryId / categoryName 字符串列迁移为 categoryKey 外键"""
+    preparer = engine.dialect.identifier_preparer
+    for table in (Transaction.__table__, TransactionArchive.__table__):
+        with engine.begin() as conn:
+            columns = {c["name"] for c in inspect(conn).get_columns(table.name)}
+            if "categoryId" not in columns:
+                continue
+            t = preparer.quote(table.name)
+            if "categoryKey" not in columns:
+                conn.execute(text(f'ALTER TABLE {t} ADD COLUMN "categoryKey" INTEGER REFERENCES category (id)'))
+            # 每个 (categoryId, categoryName) 组合一行，保留账单录入时的名称
+            conn.execute(text(
+                f'INSERT INTO category (slug, name) '
+                f'SELECT DISTINCT "categoryId", "categoryName" FROM {t} '
+                f'WHERE NOT EXISTS (SELECT 1 FROM category c '
+                f'WHERE c.slug = {t}."categoryId" AND c.name = {t}."categoryName")'
+            ))
+            conn.execute(text(
+                f'UPDATE {t} SET "categoryKey" = (SELECT id FROM category '
+                f'WHERE category.slug = {t}."categoryId" AND category.name = {t}."categoryName")'
+            ))
+            if engine.dialect.name == "postgresql":
+                conn.execute(text(f'ALTER TABLE {t} ALTER COLUMN "categoryKey" SET NOT NULL'))
+            conn.execute(text(f'ALTER TABLE {t} DROP COLUMN "categoryId"'))
+            conn.execute(text(f'ALTER TABLE {t} DROP COLUMN "categoryName"'))
+    category_cache_for(engine).invalidate()
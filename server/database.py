@@ -1,16 +1,214 @@
+import itertools
+import math
+import threading
+import time
+from collections import OrderedDict
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy import event, false, insert, literal, select
+from sqlalchemy.exc import DBAPIError
 from sqlmodel import create_engine, Session, SQLModel
+from archive import init_partitions
+from auth import get_current_user_id
+from categories import migrate_categories
 from config import CONFIG
+from models import CATALOG_TABLES, User, UserShard
+from sharding import DEFAULT_SHARD, ShardMap
 
-# 判定是否为 SQLite 决定是否添加 check_same_thread
-connect_args = {"check_same_thread": False} if CONFIG.DATABASE_URL.startswith("sqlite") else {}
-engine = create_engine(CONFIG.DATABASE_URL, connect_args=connect_args)
+def _make_engine(url: str, **kwargs):
+    # 判定是否为 SQLite 决定是否添加 check_same_thread
+    connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+    return create_engine(url, connect_args=connect_args, **kwargs)
 
-def get_session():
-    with Session(engine) as session:
+# default 分片，同时是用户目录库
+engine = _make_engine(CONFIG.DATABASE_URL)
+
+shard_map = ShardMap({
+    DEFAULT_SHARD: engine,
+    **{name: _make_engine(url) for name, url in CONFIG.SHARD_URLS.items()},
+})
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.engine = _make_engine(url, pool_pre_ping=True)
+        self.in_flight = 0
+        self.down_until = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+class ReplicaPool:
+    """只读副本池：轮询或最少并发选择，连接失败的副本暂时摘除"""
+
+    def __init__(self, urls, strategy: str = "round_robin"):
+        self.replicas = [Replica(url) for url in urls]
+        self.strategy = strategy
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def candidates(self):
+        healthy = [r for r in self.replicas if r.healthy]
+        if not healthy:
+            return []
+        if self.strategy == "least_busy":
+            return sorted(healthy, key=lambda r: r.in_flight)
+        start = next(self._counter) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def mark_down(self, replica: Replica):
+        replica.down_until = time.monotonic() + CONFIG.REPLICA_RETRY_SECONDS
+
+    def acquire(self, replica: Replica):
+        with self._lock:
+            replica.in_flight += 1
+
+    def release(self, replica: Replica):
+        with self._lock:
+            replica.in_flight -= 1
+
+replicas = ReplicaPool(CONFIG.REPLICA_URLS, CONFIG.REPLICA_SELECTION)
+
+class MemoryWriteMarks:
+    """进程内记录用户最近写入主库的时间，仅适用于单 worker"""
+
+    def __init__(self):
+        self.expires = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: str, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            self.expires.pop(user_id, None)
+            self.expires[user_id] = now + ttl
+            # 按写入先后排列，从头部清理已过期的记录
+            while self.expires:
+                first = next(iter(self.expires))
+                if self.expires[first] > now:
+                    break
+                del self.expires[first]
+
+    def recent(self, user_id: str) -> bool:
+        return self.expires.get(user_id, 0) > time.monotonic()
+
+class RedisWriteMarks:
+    """写入标记存入 Redis 并随 TTL 过期，多个 worker / 实例共享"""
+
+    def __init__(self, client, prefix: str = "lastwrite:"):
+        self.client = client
+        self.prefix = prefix
+
+    def mark(self, user_id: str, ttl: float):
+        try:
+            self.client.set(self.prefix + user_id, 1, px=int(ttl * 1000))
+        except Exception as exc:
+            print(f"Failed to record write for {user_id}: {exc}")
+
+    def recent(self, user_id: str) -> bool:
+        try:
+            return bool(self.client.exists(self.prefix + user_id))
+        except Exception:
+            # 无法确认时按刚写入处理，读主库
+            return True
+
+def _create_write_marks():
+    if CONFIG.READ_YOUR_WRITES_REDIS_URL:
+        # 仅在配置了 Redis 时才需要安装 redis 依赖
+        import redis as redis_client
+        return RedisWriteMarks(redis_client.Redis.from_url(CONFIG.READ_YOUR_WRITES_REDIS_URL))
+    return MemoryWriteMarks()
+
+write_marks = _create_write_marks()
+
+def remember_write(user_id: str):
+    write_marks.mark(user_id, CONFIG.READ_YOUR_WRITES_SECONDS)
+
+@event.listens_for(Session, "after_commit")
+def _remember_write(session):
+    request = session.info.get("request")
+    user_id = getattr(request.state, "user_id", None) if request else None
+    if user_id:
+        remember_write(user_id)
+
+def _open_session(request: Request, bind):
+    with Session(bind) as session:
+        session.info["request"] = request
         yield session
 
+def get_catalog_session(request: Request):
+    """未登录接口（注册、登录）使用：目录库会话"""
+    yield from _open_session(request, shard_map.catalog)
+
+def moving_error() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="账户数据迁移中，请稍后再试",
+        headers={"Retry-After": str(max(1, math.ceil(CONFIG.SHARD_MAP_TTL_SECONDS)))},
+    )
+
+@event.listens_for(Session, "before_commit")
+def _check_placement(session):
+    # 请求开始时的检查走缓存；提交前直接查目录再确认一次，迁移开始后不再向源分片写入
+    shard = session.info.get("shard")
+    request = session.info.get("request")
+    user_id = getattr(request.state, "user_id", None) if request else None
+    if shard and user_id and shard_map.fenced([user_id], shard):
+        raise moving_error()
+
+def get_session(request: Request, user_id: str = Depends(get_current_user_id)):
+    """当前用户所在分片的主库会话"""
+    placement = shard_map.lookup(user_id)
+    if placement.moving:
+        raise moving_error()
+    with Session(shard_map.engines[placement.shard]) as session:
+        session.info["request"] = request
+        session.info["shard"] = placement.shard
+        yield session
+
+def get_read_session(request: Request, user_id: str = Depends(get_current_user_id)):
+    """只读接口使用：优先走副本，刚写入过的用户或副本全部不可用时回退主库
+
+    REPLICA_URLS 是 default 分片的副本，其他分片的用户直接读所在分片主库。
+    迁移期间仍可读取（数据在源分片上保持不变）。
+    """
+    shard = shard_map.lookup(user_id).shard
+    if shard == DEFAULT_SHARD and replicas.replicas and not write_marks.recent(user_id):
+        for replica in replicas.candidates():
+            session = Session(replica.engine)
+            try:
+                session.connection()
+            except DBAPIError:
+                session.close()
+                replicas.mark_down(replica)
+                continue
+            replicas.acquire(replica)
+            try:
+                yield session
+            finally:
+                replicas.release(replica)
+                session.close()
+            return
+    yield from _open_session(request, shard_map.engines[shard])
+
+def _register_legacy_users():
+    # 启用分片前的用户都在 default 分片，补齐目录记录
+    with Session(engine) as session:
+        session.exec(insert(UserShard).from_select(
+            ["userId", "email", "shard", "moving"],
+            select(User.id, User.email, literal(DEFAULT_SHARD), false()).where(
+                User.id.not_in(select(UserShard.userId))
+            ),
+        ))
+        session.commit()
+
 def init_db():
-    SQLModel.metadata.create_all(engine)
+    shard_tables = [t for t in SQLModel.metadata.sorted_tables if t not in CATALOG_TABLES]
+    SQLModel.metadata.create_all(engine, tables=list(CATALOG_TABLES))
+    for shard_engine in shard_map.engines.values():
+        init_partitions(shard_engine)
+        SQLModel.metadata.create_all(shard_engine, tables=shard_tables)
+        migrate_categories(shard_engine)
+    _register_legacy_users()
 
 # 模拟 Redis 行为
 class MockRedis:
@@ -27,4 +225,4 @@ class MockRedis:
         if key in self.store:
             del self.store[key]
 
-redis = MockRedis()
\ No newline at end of file
+redis = MockRedis()
@@ -5,6 +5,7 @@ from fastapi.staticfiles import StaticFiles
 import traceback
 import os
 from database import init_db
+from writer import writer
 from routes import auth, users, transactions, assets
 from config import CONFIG
 
@@ -46,6 +47,15 @@ async def log_requests(request, call_next):
 def on_startup():
     init_db()
 
+@app.on_event("startup")
+async def start_writer():
+    if CONFIG.GROUP_COMMIT_ENABLED:
+        await writer.start()
+
+@app.on_event("shutdown")
+async def stop_writer():
+    await writer.stop()
+
 app.include_router(auth.router)
 app.include_router(users.router)
 app.include_router(transactions.router)
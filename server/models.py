@@ -1,6 +1,8 @@
 from typing import Optional, List
 from datetime import datetime
 import uuid
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.orm import object_session
 from sqlmodel import SQLModel, Field, Relationship
 
 class UserBase(SQLModel):
@@ -33,19 +35,71 @@ class Asset(AssetBase, table=True):
     user: User = Relationship(back_populates="assets")
     transactions: List["Transaction"] = Relationship(back_populates="asset")
 
-class TransactionBase(SQLModel):
+class Category(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("slug", "name"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    slug: str = Field(index=True)  # 前端使用的分类标识，如 "food"
+    name: str  # 录入时的分类名称，同一 slug 的不同名称各占一行
+
+class TransactionFields(SQLModel):
     amount: float
     type: str  # "income" | "expense"
-    categoryId: str
-    categoryName: str
     date: datetime
     note: Optional[str] = None
     assetId: Optional[str] = Field(default=None, foreign_key="asset.id")
 
-class Transaction(TransactionBase, table=True):
+class TransactionBase(TransactionFields):
+    categoryId: str
+    categoryName: str
+
+class CategoryLookup:
+    """表中只存整数分类键，对外的 categoryId / categoryName 通过进程内缓存解析"""
+
+    def _category(self):
+        from categories import category_cache_for
+        return category_cache_for(object_session(self)).get(self.categoryKey)
+
+    @property
+    def categoryId(self) -> str:
+        return self._category().slug
+
+    @property
+    def categoryName(self) -> str:
+        return self._category().name
+
+class Transaction(CategoryLookup, TransactionFields, table=True):
+    __table_args__ = (Index("ix_transaction_userId_date", "userId", "date"),)
+
     id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
     userId: str = Field(foreign_key="user.id")
+    categoryKey: int = Field(foreign_key="category.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
     user: User = Relationship(back_populates="transactions")
-    asset: Optional[Asset] = Relationship(back_populates="transactions")
\ No newline at end of file
+    asset: Optional[Asset] = Relationship(back_populates="transactions")
+
+# 已归档年份的账单，结构与 Transaction 一致
+class TransactionArchive(CategoryLookup, TransactionFields, table=True):
+    __table_args__ = (Index("ix_transactionarchive_userId_date", "userId", "date"),)
+
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()), primary_key=True)
+    userId: str = Field(foreign_key="user.id")
+    categoryKey: int = Field(foreign_key="category.id")
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+    asset: Optional[Asset] = Relationship()
+
+class ArchivedYear(SQLModel, table=True):
+    year: int = Field(primary_key=True)
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+# 用户目录：只存在于 default 分片（目录库），记录每个用户所在的分片
+class UserShard(SQLModel, table=True):
+    userId: str = Field(primary_key=True)
+    email: str = Field(unique=True, index=True)
+    shard: str
+    moving: bool = Field(default=False)  # 迁移期间暂停写入
+
+# 只建在目录库中的表
+CATALOG_TABLES = (UserShard.__table__,)
@@ -0,0 +1,201 @@
+import ipaddress
+import math
+import time
+import uuid
+from typing import Dict, Set, Tuple
+from fastapi import Depends, HTTPException, Request, status
+from jose import JWTError, jwt
+from auth import get_current_user_id
+from config import CONFIG
+from schemas import TokenRefresh
+
+# 令牌桶限流 + 重接口并发上限
+# 按 “路由类别:用户” 维度计数，超限直接返回 429 + Retry-After，不占用数据库连接
+
+class MemoryBucketStore:
+    """进程内令牌桶状态，适用于单 worker 或本地开发"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.buckets: Dict[str, Tuple[float, float]] = {}
+        self.slots: Dict[str, Set[str]] = {}
+        self.max_keys = max_keys
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        """尝试扣减令牌，成功返回 0，否则返回还需等待的秒数"""
+        now = time.monotonic()
+        tokens, ts = self.buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - ts) * rate)
+        allowed = tokens >= cost
+        self.buckets[key] = (tokens - cost if allowed else tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self._evict(now)
+        return 0.0 if allowed else (cost - tokens) / rate
+
+    def _evict(self, now: float):
+        # 已回满的桶与新建桶等价，可以直接丢弃
+        full_after = max(b / r for r, b in CONFIG.RATE_LIMITS.values())
+        self.buckets = {k: v for k, v in self.buckets.items() if now - v[1] < full_after}
+
+    async def acquire(self, key: str, lease: str, limit: int, ttl: float) -> bool:
+        """占用一个并发槽位，槽位已满返回 False；进程内计数不会泄漏，ttl 不使用"""
+        holders = self.slots.setdefault(key, set())
+        if len(holders) >= limit:
+            return False
+        holders.add(lease)
+        return True
+
+    async def release(self, key: str, lease: str):
+        holders = self.slots.get(key)
+        if holders is not None:
+            holders.discard(lease)
+            if not holders:
+                del self.slots[key]
+
+
+class RedisBucketStore:
+    """基于 Redis 的令牌桶状态，多 worker / 多实例共享"""
+
+    # 在 Redis 端原子地完成补充与扣减，时间取 Redis 服务器时钟，避免各节点时钟不一致
+    SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local wait = 0
+if tokens >= cost then
+  tokens = tokens - cost
+else
+  wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000))
+return tostring(wait)
+"""
+
+    # 并发槽位用有序集合保存持有者及其租约到期时间，worker 异常退出未释放的槽位到期后自动回收
+    ACQUIRE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local limit = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+  return 0
+end
+redis.call('ZADD', KEYS[1], now + ttl, ARGV[1])
+redis.call('PEXPIRE', KEYS[1], math.ceil(ttl * 1000))
+return 1
+"""
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> float:
+        wait = await self.client.eval(self.SCRIPT, 1, self.prefix + key, rate, burst, cost)
+        return float(wait)
+
+    async def acquire(self, key: str, lease: str, limit: int, ttl: float) -> bool:
+        ok = await self.client.eval(self.ACQUIRE_SCRIPT, 1, self.prefix + key, lease, limit, ttl)
+        return bool(int(ok))
+
+    async def release(self, key: str, lease: str):
+        await self.client.zrem(self.prefix + key, lease)
+
+
+def _create_store():
+    if CONFIG.RATE_LIMIT_REDIS_URL:
+        # 仅在配置了 Redis 时才需要安装 redis 依赖
+        from redis import asyncio as aioredis
+        return RedisBucketStore(aioredis.from_url(CONFIG.RATE_LIMIT_REDIS_URL))
+    return MemoryBucketStore()
+
+store = _create_store()
+trusted_proxies = [ipaddress.ip_network(n) for n in CONFIG.TRUSTED_PROXIES]
+
+def set_store(new_store):
+    """替换限流状态存储（需实现 async take / acquire / release）"""
+    global store
+    store = new_store
+
+def _too_many_requests(retry_after: float, detail: str = "请求过于频繁，请稍后再试"):
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+async def _consume(route_class: str, subject: str):
+    if not CONFIG.RATE_LIMIT_ENABLED:
+        return
+    rate, burst = CONFIG.RATE_LIMITS[route_class]
+    wait = await store.take(f"{route_class}:{subject}", rate, burst)
+    if wait > 0:
+        raise _too_many_requests(wait)
+
+def rate_limit(route_class: str):
+    """按用户限流的依赖，放在路由的 dependencies 中，先于数据库会话执行"""
+    async def dependency(user_id: str = Depends(get_current_user_id)):
+        await _consume(route_class, user_id)
+    return dependency
+
+def client_ip(request: Request) -> str:
+    """客户端真实 IP：直连方是受信任的反向代理（前端 nginx）时取其设置的 X-Real-IP"""
+    if not request.client:
+        return "unknown"
+    host = request.client.host
+    try:
+        peer = ipaddress.ip_address(host)
+    except ValueError:
+        return host
+    if any(peer in network for network in trusted_proxies):
+        # nginx 以 $remote_addr 覆盖 X-Real-IP；X-Forwarded-For 只有最后一段由代理追加，可信
+        forwarded = request.headers.get("x-real-ip") or request.headers.get("x-forwarded-for", "").split(",")[-1].strip()
+        if forwarded:
+            return forwarded
+    return host
+
+def rate_limit_by_ip(route_class: str):
+    """未登录接口（登录、注册）按客户端 IP 限流"""
+    async def dependency(request: Request):
+        await _consume(route_class, client_ip(request))
+    return dependency
+
+def rate_limit_refresh(route_class: str):
+    """刷新 Token 按 Token 所属用户限流，Token 无效时按客户端 IP"""
+    async def dependency(request: Request, data: TokenRefresh):
+        try:
+            payload = jwt.decode(data.refreshToken, CONFIG.JWT_REFRESH_SECRET, algorithms=[CONFIG.ALGORITHM])
+            subject = payload.get("sub")
+        except JWTError:
+            subject = None
+        await _consume(route_class, subject or client_ip(request))
+    return dependency
+
+async def limit_heavy(user_id: str = Depends(get_current_user_id)):
+    """重统计接口：先过令牌桶，再依次占用用户与全局并发槽位，请求结束后释放
+
+    单个用户最多占 HEAVY_CONCURRENCY_PER_USER 个槽位，突发请求不会挤占其他用户。
+    """
+    await _consume("heavy", user_id)
+    if not CONFIG.RATE_LIMIT_ENABLED:
+        yield
+        return
+    lease = uuid.uuid4().hex
+    user_key = f"heavy:inflight:{user_id}"
+    if not await store.acquire(user_key, lease, CONFIG.HEAVY_CONCURRENCY_PER_USER, CONFIG.HEAVY_LEASE_SECONDS):
+        raise _too_many_requests(1)
+    try:
+        if not await store.acquire("heavy:inflight", lease, CONFIG.HEAVY_CONCURRENCY, CONFIG.HEAVY_LEASE_SECONDS):
+            raise _too_many_requests(1, detail="服务繁忙，请稍后再试")
+        try:
+            yield
+        finally:
+            await store.release("heavy:inflight", lease)
+    finally:
+        await store.release(user_key, lease)
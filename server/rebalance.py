@@ -0,0 +1,153 @@
+"""用户分片迁移工具
+
+在线迁移一个用户的步骤：
+  1. 目录中标记 moving，等待 SHARD_MAP_TTL_SECONDS 让所有 worker 看到标记，此后该用户的写请求返回 503，读请求仍走源分片
+  2. 把用户、资产、账单（含归档）复制到目标分片，分类按 slug 映射为目标库中的整数键
+  3. 目录切换到目标分片并取消标记，再等待一个 TTL，确保没有 worker 还在读源分片
+  4. 锁定并重新读取源分片数据，与复制时一致才按主键删除；否则保留源数据并报错，
+     避免删掉复制之后才提交的写入（写请求提交前会直接查目录，正常情况下不会出现）
+
+用法（在 server 目录下）：
+    python rebalance.py plan                   # 列出目录分片与哈希环不一致的用户
+    python rebalance.py apply                  # 按哈希环迁移上述所有用户（新增分片后使用）
+    python rebalance.py move <user_id> <shard> # 把指定用户迁移到指定分片
+"""
+import time
+from sqlmodel import Session, delete, select
+from archive import table_for_year
+from categories import category_cache_for
+from config import CONFIG
+from models import Asset, Transaction, TransactionArchive, User, UserShard
+import database
+
+def _wait_for_workers():
+    time.sleep(CONFIG.SHARD_MAP_TTL_SECONDS)
+
+def _set_placement(user_id: str, **values):
+    with Session(database.shard_map.catalog) as session:
+        entry = session.get(UserShard, user_id)
+        for key, value in values.items():
+            setattr(entry, key, value)
+        session.add(entry)
+        session.commit()
+    database.shard_map.forget(user_id)
+
+USER_MODELS = (User, Asset, Transaction, TransactionArchive)
+
+def _read_user_data(session: Session, user_id: str, lock: bool = False):
+    """用户在某个分片上的全部数据：{模型: {主键: 字段}}"""
+    data = {}
+    for model in USER_MODELS:
+        key = model.id if model is User else model.userId
+        statement = select(model).where(key == user_id)
+        if lock:
+            statement = statement.with_for_update()
+        data[model] = {row.id: row.model_dump() for row in session.exec(statement).all()}
+    return data
+
+def _delete_user_data(session: Session, user_id: str):
+    for model in (Transaction, TransactionArchive):
+        session.exec(delete(model).where(model.userId == user_id))
+    session.exec(delete(Asset).where(Asset.userId == user_id))
+    session.exec(delete(User).where(User.id == user_id))
+
+def _copy_user_data(source: Session, target: Session, user_id: str):
+    """把源分片上的数据写入目标分片，返回复制时读到的数据"""
+    # 先清掉上次中断可能留下的半成品
+    _delete_user_data(target, user_id)
+
+    data = _read_user_data(source, user_id)
+    for model in (User, Asset):
+        for fields in data[model].values():
+            target.add(model(**fields))
+    target.flush()
+
+    source_categories = category_cache_for(source)
+    target_categories = category_cache_for(target)
+    target_models = {}
+    for model in (Transaction, TransactionArchive):
+        for fields in data[model].values():
+            fields = dict(fields)
+            category = source_categories.get(fields["categoryKey"])
+            fields["categoryKey"] = target_categories.resolve(target, category.slug, category.name)
+            # 按目标分片的归档状态决定写入热表还是归档表
+            year = fields["date"].year
+            if year not in target_models:
+                target_models[year] = table_for_year(target, year)
+            target.add(target_models[year](**fields))
+    return data
+
+def _delete_copied_data(source: Session, user_id: str, copied):
+    current = _read_user_data(source, user_id, lock=True)
+    if current != copied:
+        raise RuntimeError(
+            f"Data of {user_id} changed on the source shard after copying; "
+            f"kept it there, reconcile before deleting"
+        )
+    # 按复制时的主键删除，之后新插入的行不会被删掉
+    for model in (Transaction, TransactionArchive, Asset, User):
+        if copied[model]:
+            source.exec(delete(model).where(model.id.in_(list(copied[model]))))
+
+def move_user(user_id: str, target_shard: str):
+    shard_map = database.shard_map
+    if target_shard not in shard_map.engines:
+        raise ValueError(f"Unknown shard: {target_shard}")
+    with Session(shard_map.catalog) as session:
+        entry = session.get(UserShard, user_id)
+    if entry is None:
+        raise ValueError(f"Unknown user: {user_id}")
+    source_shard = entry.shard
+    if source_shard == target_shard:
+        return
+
+    _set_placement(user_id, moving=True)
+    _wait_for_workers()
+    try:
+        with Session(shard_map.engines[source_shard]) as source, \
+                Session(shard_map.engines[target_shard]) as target:
+            copied = _copy_user_data(source, target, user_id)
+            target.commit()
+    except Exception:
+        _set_placement(user_id, moving=False)
+        raise
+
+    _set_placement(user_id, shard=target_shard, moving=False)
+    _wait_for_workers()
+
+    with Session(shard_map.engines[source_shard]) as source:
+        _delete_copied_data(source, user_id, copied)
+        source.commit()
+
+def plan():
+    """目录中所在分片与哈希环计算结果不一致的用户"""
+    shard_map = database.shard_map
+    with Session(shard_map.catalog) as session:
+        entries = session.exec(select(UserShard)).all()
+    return [
+        (entry.userId, entry.shard, shard_map.ring_shard(entry.userId))
+        for entry in entries
+        if entry.shard != shard_map.ring_shard(entry.userId)
+    ]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move users between database shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("plan")
+    sub.add_parser("apply")
+    move = sub.add_parser("move")
+    move.add_argument("user_id")
+    move.add_argument("shard")
+    args = parser.parse_args()
+
+    database.init_db()
+    if args.command == "move":
+        move_user(args.user_id, args.shard)
+        print(f"moved {args.user_id} -> {args.shard}")
+    else:
+        for user_id, current, wanted in plan():
+            if args.command == "apply":
+                move_user(user_id, wanted)
+            print(f"{user_id}: {current} -> {wanted}")
@@ -1,14 +1,15 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlmodel import Session, select
-from database import get_session
+from database import get_session, get_read_session
 from models import Asset
 from schemas import AssetCreate, AssetRead
 from auth import get_current_user_id
+from ratelimit import rate_limit
 from typing import List
 
 router = APIRouter(prefix="/api/assets", tags=["assets"])
 
-@router.post("/", response_model=AssetRead)
+@router.post("/", response_model=AssetRead, dependencies=[Depends(rate_limit("default"))])
 async def create_asset(
     asset_data: AssetCreate,
     user_id: str = Depends(get_current_user_id),
@@ -20,15 +21,15 @@ async def create_asset(
     session.refresh(asset)
     return asset
 
-@router.get("/", response_model=List[AssetRead])
+@router.get("/", response_model=List[AssetRead], dependencies=[Depends(rate_limit("list"))])
 async def get_assets(
     user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     statement = select(Asset).where(Asset.userId == user_id)
     return session.exec(statement).all()
 
-@router.put("/{asset_id}", response_model=AssetRead)
+@router.put("/{asset_id}", response_model=AssetRead, dependencies=[Depends(rate_limit("default"))])
 async def update_asset(
     asset_id: str,
     asset_data: AssetCreate,
@@ -47,7 +48,7 @@ async def update_asset(
     session.refresh(asset)
     return asset
 
-@router.delete("/{asset_id}")
+@router.delete("/{asset_id}", dependencies=[Depends(rate_limit("default"))])
 async def delete_asset(
     asset_id: str,
     user_id: str = Depends(get_current_user_id),
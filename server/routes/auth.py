@@ -1,17 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlmodel import Session, select
-from database import get_session, redis
-from models import User
+from database import get_catalog_session, redis, shard_map
+from models import User, UserShard
 from schemas import UserCreate, UserLogin, Token, TokenRefresh
 from auth import get_password_hash, verify_password, create_tokens, create_token, get_current_user_id
+from ratelimit import rate_limit, rate_limit_by_ip, rate_limit_refresh
 from config import CONFIG
 from jose import jwt, JWTError
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
-@router.post("/register")
-async def register(user_data: UserCreate, session: Session = Depends(get_session)):
-    statement = select(User).where(User.email == user_data.email)
+@router.post("/register", dependencies=[Depends(rate_limit_by_ip("auth"))])
+async def register(user_data: UserCreate, session: Session = Depends(get_catalog_session)):
+    statement = select(UserShard).where(UserShard.email == user_data.email)
     existing_user = session.exec(statement).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="注册失败，邮箱可能已被使用")
@@ -22,15 +23,27 @@ async def register(user_data: UserCreate, session: Session = Depends(get_session
         password=hashed_pwd,
         nickname=user_data.nickname or "新用户"
     )
-    session.add(new_user)
+    # 先在目录库占用邮箱，再写入用户所在分片
+    entry = UserShard(userId=new_user.id, email=new_user.email, shard=shard_map.ring_shard(new_user.id))
+    session.add(entry)
     session.commit()
-    session.refresh(new_user)
-    return {"message": "注册成功", "userId": new_user.id}
+    try:
+        with Session(shard_map.engines[entry.shard]) as shard_session:
+            shard_session.add(new_user)
+            shard_session.commit()
+    except Exception:
+        session.delete(entry)
+        session.commit()
+        raise
+    return {"message": "注册成功", "userId": entry.userId}
 
-@router.post("/login", response_model=Token)
-async def login(login_data: UserLogin, session: Session = Depends(get_session)):
-    statement = select(User).where(User.email == login_data.email)
-    user = session.exec(statement).first()
+@router.post("/login", response_model=Token, dependencies=[Depends(rate_limit_by_ip("auth"))])
+async def login(login_data: UserLogin, session: Session = Depends(get_catalog_session)):
+    entry = session.exec(select(UserShard).where(UserShard.email == login_data.email)).first()
+    user = None
+    if entry:
+        with Session(shard_map.engines[entry.shard]) as shard_session:
+            user = shard_session.get(User, entry.userId)
     if not user or not verify_password(login_data.password, user.password):
         raise HTTPException(status_code=400, detail="用户不存在或密码错误")
     
@@ -48,7 +61,7 @@ async def login(login_data: UserLogin, session: Session = Depends(get_session)):
         }
     }
 
-@router.post("/refresh-token")
+@router.post("/refresh-token", dependencies=[Depends(rate_limit_refresh("auth"))])
 async def refresh_token(data: TokenRefresh):
     try:
         payload = jwt.decode(data.refreshToken, CONFIG.JWT_REFRESH_SECRET, algorithms=[CONFIG.ALGORITHM])
@@ -69,7 +82,7 @@ async def refresh_token(data: TokenRefresh):
     except JWTError:
         raise HTTPException(status_code=403, detail="Invalid Refresh Token")
 
-@router.post("/logout")
+@router.post("/logout", dependencies=[Depends(rate_limit("default"))])
 async def logout(user_id: str = Depends(get_current_user_id)):
     await redis.delete(f"refresh_token:{user_id}")
     return {"message": "已退出登录"}
\ No newline at end of file
@@ -1,140 +1,107 @@
+from collections import defaultdict
 from fastapi import APIRouter, Depends
-from sqlmodel import Session, select, func, desc
+from sqlmodel import Session, select, func
 from typing import List
-from database import get_session
-from models import Transaction, Asset
+from config import CONFIG
+from database import get_session, get_read_session
+from models import Transaction, TransactionArchive
 from schemas import TransactionCreate, TransactionRead
 from auth import get_current_user_id
+from categories import category_cache_for
+from ratelimit import rate_limit, limit_heavy
+from writer import writer, apply_balance_deltas, create_transaction_op, update_transaction_op, delete_transaction_op
 
 router = APIRouter(prefix="/transactions", tags=["transactions"])
 
-@router.post("", response_model=TransactionRead)
+@router.post("", response_model=TransactionRead, dependencies=[Depends(rate_limit("default"))])
 async def create_transaction(
     transaction_data: TransactionCreate,
     user_id: str = Depends(get_current_user_id),
     session: Session = Depends(get_session)
 ):
-    # 创建账单记录
-    transaction = Transaction(**transaction_data.dict(), userId=user_id)
-    session.add(transaction)
-    
-    # 如果关联了资产账户，更新余额
-    if transaction.assetId:
-        asset = session.get(Asset, transaction.assetId)
-        if asset and asset.userId == user_id:
-            if transaction.type == "expense":
-                asset.balance -= transaction.amount
-            else:
-                asset.balance += transaction.amount
-            session.add(asset)
-    
+    if CONFIG.GROUP_COMMIT_ENABLED:
+        return await writer.submit(create_transaction_op, user_id, transaction_data)
+
+    deltas = defaultdict(float)
+    transaction = create_transaction_op(session, user_id, transaction_data, deltas)
+    apply_balance_deltas(session, deltas)
     session.commit()
     session.refresh(transaction)
     return transaction
 
-@router.put("/{transaction_id}", response_model=TransactionRead)
+@router.put("/{transaction_id}", response_model=TransactionRead, dependencies=[Depends(rate_limit("default"))])
 async def update_transaction(
     transaction_id: str,
     data: TransactionCreate,
     user_id: str = Depends(get_current_user_id),
     session: Session = Depends(get_session)
 ):
-    transaction = session.get(Transaction, transaction_id)
-    if not transaction or transaction.userId != user_id:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    # 1. 回滚旧资产余额
-    if transaction.assetId:
-        old_asset = session.get(Asset, transaction.assetId)
-        if old_asset:
-            if transaction.type == "expense":
-                old_asset.balance += transaction.amount
-            else:
-                old_asset.balance -= transaction.amount
-            session.add(old_asset)
+    if CONFIG.GROUP_COMMIT_ENABLED:
+        return await writer.submit(update_transaction_op, user_id, transaction_id, data)
 
-    # 2. 更新账单数据
-    for key, value in data.dict().items():
-        setattr(transaction, key, value)
-    
-    # 3. 应用新资产余额
-    if transaction.assetId:
-        new_asset = session.get(Asset, transaction.assetId)
-        if new_asset:
-            if transaction.type == "expense":
-                new_asset.balance -= transaction.amount
-            else:
-                new_asset.balance += transaction.amount
-            session.add(new_asset)
-            
-    session.add(transaction)
+    deltas = defaultdict(float)
+    transaction = update_transaction_op(session, user_id, transaction_id, data, deltas)
+    apply_balance_deltas(session, deltas)
     session.commit()
     session.refresh(transaction)
     return transaction
 
-@router.delete("/{transaction_id}")
+@router.delete("/{transaction_id}", dependencies=[Depends(rate_limit("default"))])
 async def delete_transaction(
     transaction_id: str,
     user_id: str = Depends(get_current_user_id),
     session: Session = Depends(get_session)
 ):
-    transaction = session.get(Transaction, transaction_id)
-    if not transaction or transaction.userId != user_id:
-        raise HTTPException(status_code=404, detail="Transaction not found")
-    
-    # 回滚资产余额
-    if transaction.assetId:
-        asset = session.get(Asset, transaction.assetId)
-        if asset:
-            if transaction.type == "expense":
-                asset.balance += transaction.amount
-            else:
-                asset.balance -= transaction.amount
-            session.add(asset)
-            
-    session.delete(transaction)
+    if CONFIG.GROUP_COMMIT_ENABLED:
+        return await writer.submit(delete_transaction_op, user_id, transaction_id)
+
+    deltas = defaultdict(float)
+    result = delete_transaction_op(session, user_id, transaction_id, deltas)
+    apply_balance_deltas(session, deltas)
     session.commit()
-    return {"message": "Deleted"}
+    return result
 
-@router.get("", response_model=List[TransactionRead])
+@router.get("", response_model=List[TransactionRead], dependencies=[Depends(rate_limit("list"))])
 async def get_transactions(
     user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
+    # 热表与归档表分别查询后合并
     # 多重排序：先按业务日期倒序，同一天按录入时间倒序
-    statement = select(Transaction).where(Transaction.userId == user_id).order_by(Transaction.date.desc(), Transaction.created_at.desc())
-    results = session.exec(statement).all()
+    results = []
+    for Tx in (Transaction, TransactionArchive):
+        results.extend(session.exec(select(Tx).where(Tx.userId == user_id)).all())
+    results.sort(key=lambda t: (t.date, t.created_at), reverse=True)
     return results
 
-@router.get("/stats/category")
+@router.get("/stats/category", dependencies=[Depends(limit_heavy)])
 async def get_category_stats(
     user_id: str = Depends(get_current_user_id), 
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
-    # 只统计支出
-    statement = select(
-        Transaction.categoryId, 
-        Transaction.categoryName, 
-        func.sum(Transaction.amount).label("total_amount")
-    ).where(
-        Transaction.userId == user_id,
-        Transaction.type == "expense"
-    ).group_by(
-        Transaction.categoryId,
-        Transaction.categoryName
-    ).order_by(desc("total_amount"))
-    
-    results = session.exec(statement).all()
-    
-    total_expense = sum(r.total_amount for r in results)
+    # 只统计支出；不限时间，热表与归档表分别聚合后合并
+    totals = {}
+    for Tx in (Transaction, TransactionArchive):
+        statement = select(
+            Tx.categoryKey,
+            func.sum(Tx.amount).label("total_amount")
+        ).where(
+            Tx.userId == user_id,
+            Tx.type == "expense"
+        ).group_by(Tx.categoryKey)
+        for r in session.exec(statement).all():
+            totals[r.categoryKey] = totals.get(r.categoryKey, 0.0) + r.total_amount
+
+    total_expense = sum(totals.values())
     
     details = []
-    for r in results:
-        percentage = round((r.total_amount / total_expense) * 100) if total_expense > 0 else 0
+    for category_key, amount in sorted(totals.items(), key=lambda item: item[1], reverse=True):
+        percentage = round((amount / total_expense) * 100) if total_expense > 0 else 0
+        category = category_cache_for(session).get(category_key)
         details.append({
-            "categoryId": r.categoryId,
-            "categoryName": r.categoryName,
-            "amount": r.total_amount,
+            "categoryId": category.slug,
+            "categoryName": category.name,
+            "amount": amount,
             "percentage": percentage
         })
         
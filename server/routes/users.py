@@ -1,8 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
 from sqlmodel import Session, select, func
-from database import get_session
+from database import get_session, get_read_session
 from models import User, Transaction, Asset
 from auth import get_current_user_id, get_password_hash, verify_password
+from ratelimit import rate_limit, limit_heavy
+from archive import models_for_year
+from categories import category_cache_for
 from schemas import UserMeResponse, TransactionRead
 from datetime import datetime
 from pydantic import BaseModel
@@ -14,7 +17,7 @@ from config import CONFIG
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-@router.post("/upload-avatar")
+@router.post("/upload-avatar", dependencies=[Depends(rate_limit("default"))])
 async def upload_avatar(
     file: UploadFile = File(...),
     user_id: str = Depends(get_current_user_id),
@@ -56,7 +59,7 @@ class UpdateProfileRequest(BaseModel):
     nickname: Optional[str] = None
     avatar: Optional[str] = None
 
-@router.put("/me")
+@router.put("/me", dependencies=[Depends(rate_limit("default"))])
 async def update_profile(
     data: UpdateProfileRequest,
     user_id: str = Depends(get_current_user_id),
@@ -76,7 +79,7 @@ async def update_profile(
     session.refresh(user)
     return user
 
-@router.post("/change-password")
+@router.post("/change-password", dependencies=[Depends(rate_limit("auth"))])
 async def change_password(
     data: ChangePasswordRequest,
     user_id: str = Depends(get_current_user_id),
@@ -91,10 +94,10 @@ async def change_password(
     session.commit()
     return {"message": "密码修改成功"}
 
-@router.get("/me", response_model=UserMeResponse)
+@router.get("/me", response_model=UserMeResponse, dependencies=[Depends(rate_limit("list"))])
 async def get_me(
     user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     user = session.get(User, user_id)
     if not user:
@@ -135,13 +138,13 @@ async def get_me(
         }
     }
 
-@router.get("/stats")
+@router.get("/stats", dependencies=[Depends(limit_heavy)])
 async def get_complex_stats(
     type: str = "month", # "month" or "year"
     year: int = None,
     month: int = None,
     user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     if not year:
         year = datetime.now().year
@@ -159,46 +162,51 @@ async def get_complex_stats(
         start_date = datetime(year, 1, 1)
         end_date = datetime(year + 1, 1, 1)
 
+    # 已归档年份热表与归档表都查，近期数据只查热表
+    models = models_for_year(session, year)
+
     # 1. 基础收支统计
-    income_stmt = select(func.sum(Transaction.amount)).where(
-        Transaction.userId == user_id,
-        Transaction.type == "income",
-        Transaction.date >= start_date,
-        Transaction.date < end_date
-    )
-    expense_stmt = select(func.sum(Transaction.amount)).where(
-        Transaction.userId == user_id,
-        Transaction.type == "expense",
-        Transaction.date >= start_date,
-        Transaction.date < end_date
-    )
-    
-    total_income = session.exec(income_stmt).first() or 0.0
-    total_expense = session.exec(expense_stmt).first() or 0.0
+    def get_total(t_type: str) -> float:
+        total = 0.0
+        for Tx in models:
+            stmt = select(func.sum(Tx.amount)).where(
+                Tx.userId == user_id,
+                Tx.type == t_type,
+                Tx.date >= start_date,
+                Tx.date < end_date
+            )
+            total += session.exec(stmt).first() or 0.0
+        return total
+
+    total_income = get_total("income")
+    total_expense = get_total("expense")
 
     # 2. 按分类统计收支排行 (公用逻辑)
     def get_cat_stats(t_type: str):
-        stmt = select(
-            Transaction.categoryId,
-            Transaction.categoryName,
-            func.sum(Transaction.amount).label("amount")
-        ).where(
-            Transaction.userId == user_id,
-            Transaction.type == t_type,
-            Transaction.date >= start_date,
-            Transaction.date < end_date
-        ).group_by(Transaction.categoryId, Transaction.categoryName).order_by(func.sum(Transaction.amount).desc())
-        
-        results = session.exec(stmt).all()
+        amounts = {}
+        for Tx in models:
+            stmt = select(
+                Tx.categoryKey,
+                func.sum(Tx.amount).label("amount")
+            ).where(
+                Tx.userId == user_id,
+                Tx.type == t_type,
+                Tx.date >= start_date,
+                Tx.date < end_date
+            ).group_by(Tx.categoryKey)
+            for row in session.exec(stmt).all():
+                amounts[row.categoryKey] = amounts.get(row.categoryKey, 0.0) + row.amount
+
         total = total_income if t_type == "income" else total_expense
         
         categories = []
-        for row in results:
-            percentage = int((row.amount / total * 100)) if total > 0 else 0
+        for category_key, amount in sorted(amounts.items(), key=lambda item: item[1], reverse=True):
+            percentage = int((amount / total * 100)) if total > 0 else 0
+            category = category_cache_for(session).get(category_key)
             categories.append({
-                "categoryId": row.categoryId,
-                "categoryName": row.categoryName,
-                "amount": row.amount,
+                "categoryId": category.slug,
+                "categoryName": category.name,
+                "amount": amount,
                 "percentage": percentage
             })
         return categories
@@ -210,14 +218,14 @@ async def get_complex_stats(
         "incomeCategories": get_cat_stats("income")
     }
 
-@router.get("/stats/category/{category_id}", response_model=List[TransactionRead])
+@router.get("/stats/category/{category_id}", response_model=List[TransactionRead], dependencies=[Depends(limit_heavy)])
 async def get_category_transactions(
     category_id: str,
     type: str = "expense",
     year: int = None,
     month: int = None,
     user_id: str = Depends(get_current_user_id),
-    session: Session = Depends(get_session)
+    session: Session = Depends(get_read_session)
 ):
     # 确定时间范围
     if not year: year = datetime.now().year
@@ -231,12 +239,19 @@ async def get_category_transactions(
         start_date = datetime(year, 1, 1)
         end_date = datetime(year + 1, 1, 1)
 
-    statement = select(Transaction).where(
-        Transaction.userId == user_id,
-        Transaction.categoryId == category_id,
-        Transaction.type == type,
-        Transaction.date >= start_date,
-        Transaction.date < end_date
-    ).options(joinedload(Transaction.asset)).order_by(Transaction.amount.desc())
-    
-    return session.exec(statement).all()
\ No newline at end of file
+    category_keys = category_cache_for(session).keys_for(category_id)
+    if not category_keys:
+        return []
+
+    results = []
+    for Tx in models_for_year(session, year):
+        statement = select(Tx).where(
+            Tx.userId == user_id,
+            Tx.categoryKey.in_(category_keys),
+            Tx.type == type,
+            Tx.date >= start_date,
+            Tx.date < end_date
+        ).options(joinedload(Tx.asset))
+        results.extend(session.exec(statement).all())
+    results.sort(key=lambda t: t.amount, reverse=True)
+    return results
\ No newline at end of file
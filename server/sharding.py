@@ -0,0 +1,80 @@
+import bisect
+import hashlib
+import threading
+import time
+from typing import Dict, Iterable, NamedTuple, Set
+from sqlmodel import Session, select
+from config import CONFIG
+from models import UserShard
+
+DEFAULT_SHARD = "default"
+
+def _hash(value: str) -> int:
+    # 不能用内置 hash()：它在每个进程中随机化
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+class HashRing:
+    """一致性哈希环，每个分片放置若干虚拟节点，增减分片时只有少量用户需要迁移"""
+
+    def __init__(self, names, vnodes: int = 64):
+        points = sorted((_hash(f"{name}#{i}"), name) for name in names for i in range(vnodes))
+        self._keys = [p for p, _ in points]
+        self._names = [name for _, name in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._keys, _hash(key)) % len(self._keys)
+        return self._names[index]
+
+class Placement(NamedTuple):
+    shard: str
+    moving: bool
+
+class ShardMap:
+    """用户 -> 分片的映射
+
+    新用户按一致性哈希落到某个分片，注册时写入目录表（default 分片），
+    之后以目录为准，迁移工具通过修改目录来移动用户。目录查询结果在进程内缓存
+    SHARD_MAP_TTL_SECONDS 秒。
+    """
+
+    def __init__(self, engines: Dict[str, object]):
+        self.engines = engines
+        self.ring = HashRing(engines.keys())
+        self._cache: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def catalog(self):
+        return self.engines[DEFAULT_SHARD]
+
+    def ring_shard(self, user_id: str) -> str:
+        return self.ring.node_for(user_id)
+
+    def lookup(self, user_id: str) -> Placement:
+        now = time.monotonic()
+        cached = self._cache.get(user_id)
+        if cached and cached[1] > now:
+            return cached[0]
+        with Session(self.catalog) as session:
+            row = session.get(UserShard, user_id)
+        # 目录中没有记录的只可能是分片前的老数据，它们都在 default 分片
+        placement = Placement(row.shard, row.moving) if row else Placement(DEFAULT_SHARD, False)
+        with self._lock:
+            self._cache[user_id] = (placement, now + CONFIG.SHARD_MAP_TTL_SECONDS)
+        return placement
+
+    def forget(self, user_id: str):
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def fenced(self, user_ids: Iterable[str], shard: str) -> Set[str]:
+        """直接查目录（不走缓存），返回当前不能再写入 shard 的用户：迁移中或已迁走
+
+        写事务提交前调用，缩小“通过缓存检查后迁移才开始”的窗口
+        """
+        user_ids = set(user_ids)
+        with Session(self.catalog) as session:
+            rows = session.exec(select(UserShard).where(UserShard.userId.in_(user_ids))).all()
+        placements = {row.userId: Placement(row.shard, row.moving) for row in rows}
+        writable = Placement(shard, False)
+        return {u for u in user_ids if placements.get(u, Placement(DEFAULT_SHARD, False)) != writable}
@@ -0,0 +1,218 @@
+import asyncio
+from collections import defaultdict
+from typing import Dict
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import Session, update
+import database
+from archive import table_for_year
+from categories import category_cache_for
+from config import CONFIG
+from models import Transaction, TransactionArchive, Asset
+from schemas import TransactionCreate, TransactionRead
+
+# 账单写操作：只登记资产余额变化量，由调用方统一落库，便于批量合并
+
+def _signed_amount(transaction: Transaction) -> float:
+    return -transaction.amount if transaction.type == "expense" else transaction.amount
+
+def _row_fields(session: Session, data: TransactionCreate) -> dict:
+    # 分类以整数键入库，名称由分类表维护
+    fields = data.dict(exclude={"categoryId", "categoryName"})
+    fields["categoryKey"] = category_cache_for(session).resolve(session, data.categoryId, data.categoryName)
+    return fields
+
+def _find_transaction(session: Session, user_id: str, transaction_id: str):
+    # 已归档年份的账单在归档表中，同样允许修改和删除
+    for model in (Transaction, TransactionArchive):
+        transaction = session.get(model, transaction_id)
+        if transaction and transaction.userId == user_id:
+            return transaction
+    raise HTTPException(status_code=404, detail="Transaction not found")
+
+def create_transaction_op(session: Session, user_id: str, data: TransactionCreate, deltas: Dict[str, float]):
+    # 补记已归档年份的账单直接写入归档表
+    Tx = table_for_year(session, data.date.year)
+    transaction = Tx(**_row_fields(session, data), userId=user_id)
+    session.add(transaction)
+
+    # 如果关联了资产账户，更新余额
+    if transaction.assetId:
+        asset = session.get(Asset, transaction.assetId)
+        if asset and asset.userId == user_id:
+            deltas[asset.id] += _signed_amount(transaction)
+    return transaction
+
+def update_transaction_op(session: Session, user_id: str, transaction_id: str, data: TransactionCreate, deltas: Dict[str, float]):
+    transaction = _find_transaction(session, user_id, transaction_id)
+
+    # 1. 回滚旧资产余额
+    if transaction.assetId and session.get(Asset, transaction.assetId):
+        deltas[transaction.assetId] -= _signed_amount(transaction)
+
+    # 2. 更新账单数据；日期改到另一张表负责的年份时，把账单搬到该表
+    fields = _row_fields(session, data)
+    Tx = table_for_year(session, data.date.year)
+    if isinstance(transaction, Tx):
+        for key, value in fields.items():
+            setattr(transaction, key, value)
+    else:
+        kept = {"id": transaction.id, "userId": user_id, "created_at": transaction.created_at}
+        session.delete(transaction)
+        session.flush()
+        transaction = Tx(**fields, **kept)
+
+    # 3. 应用新资产余额
+    if transaction.assetId and session.get(Asset, transaction.assetId):
+        deltas[transaction.assetId] += _signed_amount(transaction)
+
+    session.add(transaction)
+    return transaction
+
+def delete_transaction_op(session: Session, user_id: str, transaction_id: str, deltas: Dict[str, float]):
+    transaction = _find_transaction(session, user_id, transaction_id)
+
+    # 回滚资产余额
+    if transaction.assetId and session.get(Asset, transaction.assetId):
+        deltas[transaction.assetId] -= _signed_amount(transaction)
+
+    session.delete(transaction)
+    return {"message": "Deleted"}
+
+def apply_balance_deltas(session: Session, deltas: Dict[str, float]):
+    # 每个资产只执行一次 UPDATE，由数据库完成加减，避免读改写丢失更新
+    for asset_id, delta in deltas.items():
+        if delta:
+            session.exec(update(Asset).where(Asset.id == asset_id).values(balance=Asset.balance + delta))
+
+class GroupCommitWriter:
+    """把并发的账单写请求按时间/数量攒批，在同一个数据库事务中提交
+
+    每个操作在独立的 SAVEPOINT 中执行，单个操作失败只影响其调用方；
+    同一批内的资产余额变化按资产合并后一次性更新。
+    """
+
+    def __init__(self, max_batch: int = 64, max_delay_ms: int = 5):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.queue = None
+        self.task = None
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.queue and not self.queue.empty():
+            *_, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Writer stopped"))
+
+    async def submit(self, op, user_id: str, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((op, user_id, args, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            if not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            try:
+                outcomes = await run_in_threadpool(self._commit_batch, batch)
+            except Exception as exc:
+                outcomes = [(False, exc)] * len(batch)
+            for (*_, future), (ok, value) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    def _commit_batch(self, batch):
+        # 不同分片的用户分别在各自的数据库事务中提交
+        by_shard = defaultdict(list)
+        for index, item in enumerate(batch):
+            by_shard[database.shard_map.lookup(item[1]).shard].append(index)
+        results = [None] * len(batch)
+        for shard, indexes in by_shard.items():
+            items = [batch[i] for i in indexes]
+            try:
+                outcomes = self._commit_shard(shard, items)
+            except Exception as exc:
+                outcomes = [(False, exc)] * len(items)
+            for i, outcome in zip(indexes, outcomes):
+                results[i] = outcome
+        return results
+
+    def _commit_shard(self, shard: str, batch):
+        # 排队期间用户可能已开始迁移，执行前直接查目录确认
+        fenced = database.shard_map.fenced({user_id for _, user_id, _, _ in batch}, shard)
+        engine = database.shard_map.engines[shard]
+        with Session(engine, expire_on_commit=False) as session:
+            if engine.dialect.name == "sqlite":
+                # pysqlite 不会在 SAVEPOINT 前发出 BEGIN，第一个 SAVEPOINT 自成事务、RELEASE 即提交；
+                # 先显式开启外层事务，保证整批（含余额更新）只提交一次
+                session.connection().exec_driver_sql("BEGIN")
+            deltas = defaultdict(float)
+            outcomes = []
+            for op, user_id, args, _ in batch:
+                if user_id in fenced:
+                    outcomes.append((False, database.moving_error()))
+                    continue
+                op_deltas = defaultdict(float)
+                savepoint = session.begin_nested()
+                try:
+                    value = op(session, user_id, *args, op_deltas)
+                    savepoint.commit()
+                except Exception as exc:
+                    savepoint.rollback()
+                    outcomes.append((False, exc))
+                    continue
+                for asset_id, delta in op_deltas.items():
+                    deltas[asset_id] += delta
+                outcomes.append((True, value))
+
+            apply_balance_deltas(session, deltas)
+            session.commit()
+
+            for user_id in {user_id for _, user_id, _, _ in batch}:
+                database.remember_write(user_id)
+
+            # 账单字段均由应用侧生成，无需逐条 refresh；只重新加载余额有变化的资产
+            for asset_id in deltas:
+                asset = session.get(Asset, asset_id)
+                if asset:
+                    session.refresh(asset)
+
+            results = []
+            for ok, value in outcomes:
+                if ok and isinstance(value, (Transaction, TransactionArchive)):
+                    value = TransactionRead.model_validate(value)
+                results.append((ok, value))
+            return results
+
+writer = GroupCommitWriter(CONFIG.GROUP_COMMIT_MAX_BATCH, CONFIG.GROUP_COMMIT_MAX_DELAY_MS)